@@ -125,7 +125,7 @@ def create_app(config_class=Config):
 
     # --- Start Background Scheduler ---
     if not app.config.get("TESTING"):
-        from app.jobs import refresh_ldap_cache
+        from app.jobs import clear_expired_reset_tokens, refresh_ldap_cache
 
         # Run the job once on startup to ensure cache is populated immediately
         with app.app_context():
@@ -137,6 +137,7 @@ def create_app(config_class=Config):
             trigger="interval",
             seconds=app.config["CACHE_REFRESH_INTERVAL"],
         )
+        scheduler.add_job(func=clear_expired_reset_tokens, args=[app], trigger="interval", hours=1)
         scheduler.start()
         # Ensure the scheduler is shut down when the app exits
         atexit.register(scheduler.shutdown)
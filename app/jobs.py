@@ -17,8 +17,92 @@
 # Author: Taco Scheltema https://github.com/TacoScheltema/blackbook
 #
 
-from app import cache
-from app.ldap_utils import search_ldap
+import base64
+import threading
+from datetime import datetime, timezone
+
+from flask import current_app
+
+from app import cache, db
+from app.ldap_utils import escape_filter_value, search_ldap
+from app.models import User
+
+OBJECT_CLASS_FILTER_TPL = "(objectClass={cls})"
+
+# Serialises cache refreshes, so a refresh scheduled by a write waits for a running one
+# instead of overlapping it and possibly storing older results after it.
+_refresh_lock = threading.Lock()
+
+
+def get_list_attributes(config):
+    """
+    Returns the attributes to fetch for the cached contact list: the configured
+    list attributes plus the ones the app itself needs for grouping, filtering
+    and the company org chart.
+    """
+    required = ["cn", "sn", "title", "manager", config["LDAP_COMPANY_LINK_ATTRIBUTE"], config["LDAP_OWNER_ATTRIBUTE"]]
+    list_attrs = list(config["LDAP_PERSON_LIST_ATTRIBUTES"])
+    return list_attrs + [attr for attr in required if attr not in list_attrs]
+
+
+def prepare_contact(person):
+    """
+    Precomputes derived values on a contact before it is cached, so list
+    pages don't have to redo the work on every request.
+    """
+    # The raw photo bytes are only needed when a single entry is fetched from
+    # LDAP, so keep just the ready-to-use data URL in the cache.
+    photo = person.pop("jpegPhoto", None)
+    if photo and photo[0]:
+        person["_avatar_data_url"] = "data:image/jpeg;base64," + base64.b64encode(photo[0]).decode("ascii")
+
+    # URL-safe DN for the detail, edit and privacy links on every list row.
+    person["_b64_dn"] = base64.urlsafe_b64encode(person["dn"].encode("utf-8")).decode("utf-8")
+
+    # Normalized keys for the search and letter filters on the index page.
+    person["_cn_key"] = (person.get("cn") or [""])[0].lower()
+    person["_sn_key"] = (person.get("sn") or [""])[0].upper()
+    # Lowercased sort key per attribute, so sorting the index page needs no string work.
+    person["_sort_keys"] = {
+        attr: values[0].lower()
+        for attr, values in person.items()
+        if not attr.startswith("_") and isinstance(values, list) and values and isinstance(values[0], str)
+    }
+    return person
+
+
+def sort_by_surname(people):
+    """Sorts a list of contacts in place by surname, case-insensitively."""
+    people.sort(key=lambda p: (p.get("sn") or [""])[0].casefold())
+    return people
+
+
+def build_company_index(people, company_link_attr):
+    """Groups contacts by company name, each group sorted by surname."""
+    company_index = {}
+    for person in people:
+        company = (person.get(company_link_attr) or [None])[0]
+        if company:
+            company_index.setdefault(company, []).append(person)
+    for employees in company_index.values():
+        sort_by_surname(employees)
+    return company_index
+
+
+def store_contacts(people_list):
+    """Stores the contact list and the indexes derived from it in the cache."""
+    company_link_attr = current_app.config["LDAP_COMPANY_LINK_ATTRIBUTE"]
+    # Store the list in the index page's default order. Sorting an already ordered
+    # list is a single linear pass, so most requests pay almost nothing for it.
+    sort_by_surname(people_list)
+    company_index = build_company_index(people_list, company_link_attr)
+    # Keep the entries alive for two refresh intervals so the background job always
+    # replaces the data before it expires; requests never see an empty cache between runs.
+    timeout = max(current_app.config["CACHE_DEFAULT_TIMEOUT"], 2 * current_app.config["CACHE_REFRESH_INTERVAL"])
+    cache.set("all_people", people_list, timeout=timeout)
+    cache.set("company_index", company_index, timeout=timeout)
+    cache.set("company_names", sorted(company_index), timeout=timeout)
+    cache.set("contact_names", {p["dn"]: (p.get("cn") or [None])[0] for p in people_list}, timeout=timeout)
 
 
 def refresh_ldap_cache(app):
@@ -26,18 +110,34 @@ def refresh_ldap_cache(app):
     This function is run by the background scheduler. It performs the slow
     LDAP query and stores the result in the cache.
     """
-    with app.app_context():
+    with _refresh_lock, app.app_context():
         print("SCHEDULER: Refreshing LDAP contact cache...")
         person_classes = app.config["LDAP_PERSON_OBJECT_CLASS"].split(",")
-        person_attrs = app.config["LDAP_PERSON_ATTRIBUTES"]
-        search_filter = "".join([f"(objectClass={cls.strip()})" for cls in person_classes])
+        person_attrs = get_list_attributes(app.config)
+        search_filter = "".join(
+            OBJECT_CLASS_FILTER_TPL.format(cls=escape_filter_value(cls.strip())) for cls in person_classes
+        )
         if len(person_classes) > 1:
             search_filter = f"(&{search_filter})"
 
         contacts_dn = app.config["LDAP_CONTACTS_DN"]
 
-        people_list = search_ldap(search_filter, person_attrs, search_base=contacts_dn)
+        people_list = [prepare_contact(p) for p in search_ldap(search_filter, person_attrs, search_base=contacts_dn)]
 
-        # Manually set the cache value. This overwrites the old data.
-        cache.set("all_people", people_list)
+        # Manually set the cache values. This overwrites the old data.
+        store_contacts(people_list)
         print(f"SCHEDULER: Cache refreshed with {len(people_list)} contacts.")
+
+
+def clear_expired_reset_tokens(app):
+    """
+    This function is run by the background scheduler. It removes password
+    reset tokens that have expired, so they don't accumulate in the user table.
+    """
+    with app.app_context():
+        cleared = User.query.filter(User.password_reset_expiration < datetime.now(timezone.utc)).update(
+            {User.password_reset_token: None, User.password_reset_expiration: None}, synchronize_session=False
+        )
+        db.session.commit()
+        if cleared:
+            print(f"SCHEDULER: Cleared {cleared} expired password reset tokens.")
@@ -20,11 +20,24 @@
 import base64
 import hashlib
 import os
+import queue
+import time
 
 import ldap3
 from flask import current_app, flash, has_request_context
 from ldap3.core.exceptions import LDAPException
 
+# RFC 4515 escapes for values interpolated into search filters.
+_FILTER_ESCAPES = str.maketrans({"\\": "\\5c", "*": "\\2a", "(": "\\28", ")": "\\29", "\0": "\\00"})
+
+MEMBER_FILTER_TPL = "(member={dn})"
+MANAGER_FILTER_TPL = "(manager={dn})"
+
+
+def escape_filter_value(value):
+    """Escapes a value for safe use inside an LDAP search filter."""
+    return value.translate(_FILTER_ESCAPES)
+
 
 def hash_password_ssha(password):
     """Hashes a password using the SSHA (Salted SHA-1) scheme."""
@@ -56,6 +69,89 @@ def get_ldap_connection(user_dn=None, password=None, read_only=False):
         return None
 
 
+def _get_read_pool():
+    """Returns the app's pool of idle, bound read-only admin connections."""
+    pool = current_app.extensions.get("ldap_read_pool")
+    if pool is None:
+        pool = current_app.extensions["ldap_read_pool"] = queue.LifoQueue(maxsize=current_app.config["LDAP_POOL_SIZE"])
+    return pool
+
+
+def acquire_read_connection():
+    """
+    Takes an idle connection from the pool, or returns None if there is none.
+    Connections idle for longer than LDAP_POOL_IDLE_TIMEOUT are unbound instead,
+    since the server or a firewall may already have dropped them.
+    """
+    pool = _get_read_pool()
+    idle_timeout = current_app.config["LDAP_POOL_IDLE_TIMEOUT"]
+    while True:
+        try:
+            conn, released_at = pool.get_nowait()
+        except queue.Empty:
+            return None
+        if time.monotonic() - released_at <= idle_timeout:
+            return conn
+        release_read_connection(conn, discard=True)
+
+
+def release_read_connection(conn, discard=False):
+    """Returns a borrowed connection to the pool, or unbinds it if it's broken or the pool is full."""
+    if not discard:
+        try:
+            _get_read_pool().put_nowait((conn, time.monotonic()))
+            return
+        except queue.Full:
+            pass
+    try:
+        conn.unbind()
+    except LDAPException:
+        pass
+
+
+def _entry_to_dict(entry, attributes):
+    """Converts an ldap3 entry into the dict shape used throughout the app."""
+    result_dict = {"dn": entry.entry_dn}
+    for attr in attributes:
+        result_dict[attr] = entry[attr].values if entry[attr] else []
+    return result_dict
+
+
+def _read_entries(attributes, **search_args):
+    """
+    Runs a search as the admin user and returns the entries as dicts, or None if
+    no connection could be made. A pooled connection that fails is discarded and
+    the search retried once on a freshly bound one, so a socket dropped while idle
+    doesn't fail the request. Raises LDAPException if the fresh connection fails too.
+    """
+
+    def read(conn):
+        conn.search(attributes=attributes, **search_args)
+        return [_entry_to_dict(entry, attributes) for entry in conn.entries]
+
+    conn = acquire_read_connection()
+    if conn is not None:
+        try:
+            results = read(conn)
+        except LDAPException as e:
+            print(f"Pooled LDAP connection failed, retrying on a new one: {e}")
+            release_read_connection(conn, discard=True)
+        else:
+            release_read_connection(conn)
+            return results
+
+    conn = get_ldap_connection(read_only=True)
+    if not conn:
+        return None
+    discard = True
+    try:
+        results = read(conn)
+        discard = False
+        return results
+    finally:
+        release_read_connection(conn, discard)
+
+
 def authenticate_ldap_user(username, password):
     """
     Attempts to bind to the LDAP server with a given username and password.
@@ -75,10 +171,12 @@ def authenticate_ldap_user(username, password):
     if not conn:
         return False, False, False
 
+    member_filter = MEMBER_FILTER_TPL.format(dn=escape_filter_value(user_dn))
+
     is_admin = False
     if admin_group_dn:
         try:
-            is_admin = conn.search(admin_group_dn, f"(member={user_dn})", attributes=["cn"])
+            is_admin = conn.search(admin_group_dn, member_filter, attributes=["cn"])
         except LDAPException as e:
             print(f"Could not check admin group membership: {e}")
             is_admin = False
@@ -86,7 +184,7 @@ def authenticate_ldap_user(username, password):
     is_editor = False
     if editor_group_dn:
         try:
-            is_editor = conn.search(editor_group_dn, f"(member={user_dn})", attributes=["cn"])
+            is_editor = conn.search(editor_group_dn, member_filter, attributes=["cn"])
         except LDAPException as e:
             print(f"Could not check editor group membership: {e}")
             is_editor = False
@@ -194,64 +292,43 @@ def search_ldap(filter_str, attributes, size_limit=0, search_base=None):
     """
     Performs a search on the LDAP directory using the admin credentials.
     """
-    conn = get_ldap_connection(read_only=True)
-    if not conn:
-        return []
-
     if search_base is None:
         search_base = current_app.config["LDAP_BASE_DN"]
 
     try:
-        # The corrected line with the added search_scope
-        conn.search(
-            search_base=search_base,
-            search_filter=filter_str,
-            search_scope=ldap3.LEVEL,  # <-- This is the fix
-            attributes=attributes,
-            size_limit=size_limit,
+        return (
+            _read_entries(
+                attributes,
+                search_base=search_base,
+                search_filter=filter_str,
+                search_scope=ldap3.LEVEL,
+                size_limit=size_limit,
+            )
+            or []
         )
-        results = []
-        for entry in conn.entries:
-            result_dict = {"dn": entry.entry_dn}
-            for attr in attributes:
-                result_dict[attr] = entry[attr].values if entry[attr] else []
-            results.append(result_dict)
-        return results
     except LDAPException as e:
         print(f"LDAP search failed: {e}")
         if has_request_context():
             flash("An error occurred while searching the directory.", "warning")
         return []
-    finally:
-        if conn:
-            conn.unbind()
 
 
-def get_entry_by_dn(dn, attributes):
+def get_entry_by_dn(dn, attributes, not_found=None):
     """
     Retrieves a single entry by its Distinguished Name (DN).
+    Returns `not_found` if the search succeeded but the entry doesn't exist,
+    and None if the directory couldn't be searched.
     """
-    conn = get_ldap_connection(read_only=True)
-    if not conn:
-        return None
-
     try:
-        conn.search(search_base=dn, search_filter="(objectClass=*)", search_scope=ldap3.BASE, attributes=attributes)
-        if conn.entries:
-            entry = conn.entries[0]
-            result_dict = {"dn": entry.entry_dn}
-            for attr in attributes:
-                result_dict[attr] = entry[attr].values if entry[attr] else []
-            return result_dict
-        return None
+        results = _read_entries(attributes, search_base=dn, search_filter="(objectClass=*)", search_scope=ldap3.BASE)
     except LDAPException as e:
         print(f"Failed to fetch entry by DN '{dn}': {e}")
         if has_request_context():
             flash("Could not retrieve the specified entry.", "warning")
         return None
-    finally:
-        if conn:
-            conn.unbind()
+    if results is None:
+        return None
+    return results[0] if results else not_found
 
 
 def add_ldap_entry(dn, object_classes, attributes):
@@ -323,7 +400,7 @@ def delete_ldap_contact(dn):
     try:
         # Find subordinates and clear their manager attribute
         search_base = current_app.config["LDAP_CONTACTS_DN"]
-        conn.search(search_base, f"(manager={dn})", attributes=[])
+        conn.search(search_base, MANAGER_FILTER_TPL.format(dn=escape_filter_value(dn)), attributes=[])
         for entry in conn.entries:
             conn.modify(entry.entry_dn, {"manager": [(ldap3.MODIFY_DELETE, [])]})
 
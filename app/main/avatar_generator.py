@@ -17,6 +17,7 @@
 # Author: Taco Scheltema https://github.com/TacoScheltema/blackbook
 #
 
+import functools
 import hashlib
 import math
 import random
@@ -98,8 +99,7 @@ BACKGROUND_COLORS = [
 
 def draw_background(dwg, seed):
     """Draws a simple background color."""
-    random.seed(seed)
-    color = random.choice(BACKGROUND_COLORS)
+    color = random.Random(seed).choice(BACKGROUND_COLORS)
     dwg.add(dwg.rect(insert=(0, 0), size=("100%", "100%"), fill=color))
 
 
@@ -379,18 +379,15 @@ def generate_avatar(seed=None, theme="all"):
     else:
         categories_to_use = list(AVATAR_CATEGORIES.keys())
 
-    random.seed(part_seed("category"))
-    chosen_category = random.choice(categories_to_use)
+    chosen_category = random.Random(part_seed("category")).choice(categories_to_use)
     avatar_types, color_palette = AVATAR_CATEGORIES[chosen_category]
 
     # Choose a specific avatar type from the category
-    random.seed(part_seed("type"))
-    chosen_type = random.choice(list(avatar_types.keys()))
+    chosen_type = random.Random(part_seed("type")).choice(list(avatar_types.keys()))
     draw_func = avatar_types[chosen_type]
 
     # Choose two distinct colors for the avatar
-    random.seed(part_seed("colors"))
-    colors = random.sample(color_palette, 2)
+    colors = random.Random(part_seed("colors")).sample(color_palette, 2)
 
     # Setup the SVG canvas (in-memory)
     dwg = svgwrite.Drawing(size=("200px", "200px"), viewBox="0 0 100 100")
@@ -400,3 +397,16 @@ def generate_avatar(seed=None, theme="all"):
     draw_func(dwg, colors)
 
     return dwg.tostring()
+
+
+@functools.lru_cache(maxsize=4096)
+def get_cached_avatar(seed, theme="all"):
+    """
+    Returns the encoded SVG for a seed together with its ETag.
+
+    Avatars are deterministic for a given (seed, theme), so each one only
+    needs to be drawn once per process.
+    """
+    svg = generate_avatar(seed=seed, theme=theme).encode("utf-8")
+    etag = hashlib.blake2b(svg, digest_size=8).hexdigest()
+    return svg, etag
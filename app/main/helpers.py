@@ -15,19 +15,39 @@
 
 import base64
 import json
-import math
 import re
 import uuid
+from datetime import datetime, timedelta, timezone
 from functools import wraps
 
 import ldap3
 import requests
 from flask import abort, current_app, request
 from flask_login import current_user
+from ldap3.utils.dn import to_dn
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from app import cache, db, scheduler
-from app.jobs import refresh_ldap_cache
-from app.ldap_utils import add_ldap_entry, ensure_ou_exists, search_ldap
+from app.jobs import get_list_attributes, prepare_contact, refresh_ldap_cache, sort_by_surname
+from app.ldap_utils import add_ldap_entry, ensure_ou_exists, get_entry_by_dn, search_ldap
+
+# Longer search queries are truncated, there is no name that long to match.
+MAX_SEARCH_QUERY_LENGTH = 128
+
+# How long a DN that wasn't found in LDAP keeps answering 404 without a new search.
+MISSING_DN_CACHE_TIMEOUT = 60
+
+# Shared HTTP session for the geocoding lookups, so repeated map views reuse
+# the pooled keep-alive connection instead of doing a new TLS handshake.
+# Only failed connects are retried; a slow read isn't, so a lookup can't hold
+# the request much longer than the read timeout.
+_http = requests.Session()
+_http.mount(
+    "https://",
+    HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=Retry(total=2, read=0, backoff_factor=0.2)),
+)
+_http.headers["User-Agent"] = "BlackbookAddressBook/1.0"
 
 
 def get_config(key):
@@ -43,9 +63,17 @@ def b64decode_with_padding(s):
     return base64.urlsafe_b64decode(s).decode("utf-8")
 
 
+def decode_b64_or_404(s):
+    """Decodes a URL-safe base64 path segment, aborting with a 404 if it's malformed."""
+    try:
+        return b64decode_with_padding(s)
+    except ValueError:
+        abort(404)
+
+
 def get_pagination_params(total_items, page, page_size):
     """Helper function to calculate pagination parameters."""
-    total_pages = math.ceil(total_items / page_size)
+    total_pages = -(-total_items // page_size)
     pages_to_show = 6
     start_page = max(1, page - (pages_to_show // 2))
     end_page = min(total_pages, start_page + pages_to_show - 1)
@@ -54,10 +82,34 @@ def get_pagination_params(total_items, page, page_size):
     return range(start_page, end_page + 1), total_pages
 
 
+def paginate(items, page, page_size):
+    """Slices one page out of a list. Returns (items_on_page, page_numbers, total_pages)."""
+    start_index = (page - 1) * page_size
+    page_numbers, total_pages = get_pagination_params(len(items), page, page_size)
+    return items[start_index : start_index + page_size], page_numbers, total_pages
+
+
+def geocode_address(address):
+    """Looks up an address with OpenStreetMap Nominatim. Returns (lat, lon) or (None, None)."""
+    try:
+        response = _http.get(
+            "https://nominatim.openstreetmap.org/search",
+            params={"format": "json", "q": address},
+            timeout=(3, 7),
+        )
+        response.raise_for_status()
+        data = response.json()
+        if data:
+            return data[0]["lat"], data[0]["lon"]
+    except requests.exceptions.RequestException as e:
+        current_app.logger.warning("Could not connect to OpenStreetMap API: %s", e)
+    return None, None
+
+
 def get_index_request_args():
     """Helper to get and process request arguments for the index page."""
     args = {
-        "search_query": request.args.get("q", ""),
+        "search_query": request.args.get("q", "")[:MAX_SEARCH_QUERY_LENGTH],
         "sort_by": request.args.get("sort_by", "sn"),
         "sort_order": request.args.get("sort_order", "asc"),
         "letter": request.args.get("letter", ""),
@@ -82,7 +134,7 @@ def get_index_request_args():
     args["page_size"] = page_size
 
     try:
-        args["page"] = int(request.args.get("page", 1))
+        args["page"] = max(1, int(request.args.get("page", 1)))
     except ValueError:
         args["page"] = 1
 
@@ -91,20 +143,14 @@ def get_index_request_args():
 
 def filter_and_sort_people(all_people, args):
     """Helper to filter and sort the list of people."""
-    if args["search_query"]:
-        query = args["search_query"].lower()
-        all_people = [p for p in all_people if p.get("cn") and p["cn"] and query in p["cn"][0].lower()]
-
-    if args["letter"]:
-        all_people = [
-            p for p in all_people if p.get("sn") and p["sn"] and p["sn"][0].upper().startswith(args["letter"])
-        ]
-
-    if args["sort_by"] in get_config("LDAP_PERSON_ATTRIBUTES"):
-        all_people.sort(
-            key=lambda p: (p.get(args["sort_by"])[0] if p.get(args["sort_by"]) else "").lower(),
-            reverse=(args["sort_order"] == "desc"),
-        )
+    query = args["search_query"].lower()
+    letter = args["letter"]
+    if query or letter:
+        all_people = [p for p in all_people if query in p["_cn_key"] and p["_sn_key"].startswith(letter)]
+
+    sort_by = args["sort_by"]
+    if sort_by in get_config("LDAP_PERSON_ATTRIBUTES"):
+        all_people.sort(key=lambda p: p["_sort_keys"].get(sort_by, ""), reverse=args["sort_order"] == "desc")
     return all_people
 
 
@@ -163,24 +209,117 @@ def editor_required(f):
     return decorated_function
 
 
-def get_visible_contacts():
-    """Gets all contacts visible to the current user (public + their private)."""
-    public_contacts = cache.get("all_people") or []
-    private_contacts = []
+def missing_dn_key(dn):
+    """Cache key under which a DN that wasn't found in LDAP is remembered."""
+    return f"missing_dn:{dn}"
+
+
+def forget_missing_dn(dn):
+    """Drops a remembered miss once an entry is created at that DN."""
+    cache.delete(missing_dn_key(dn))
+
 
+def schedule_cache_refresh(app=None):
+    """
+    Schedules a refresh of the LDAP contact cache shortly after a write.
+    All writes share one job id, so a burst of edits collapses into a
+    single refresh instead of queueing one per change. A second instance
+    may be pending while one runs, so a write made during a refresh is
+    still picked up; refresh_ldap_cache serialises the two.
+    """
+    if app is None:
+        app = current_app._get_current_object()  # pylint: disable=protected-access
+    scheduler.add_job(
+        func=refresh_ldap_cache,
+        args=[app],
+        id="ldap_cache_refresh",
+        replace_existing=True,
+        next_run_time=datetime.now(timezone.utc) + timedelta(seconds=2),
+        coalesce=True,
+        max_instances=2,
+    )
+
+
+def get_private_ou():
+    """Gets the DN of the current user's private OU, or None if private contacts are disabled."""
     private_ou_template = get_config("LDAP_PRIVATE_OU_TEMPLATE")
-    if private_ou_template:
-        user_ou = private_ou_template.format(user_id=current_user.id)
-        person_attrs = get_config("LDAP_PERSON_ATTRIBUTES")
-        private_contacts = search_ldap("(objectClass=*)", person_attrs, search_base=user_ou)
+    if not private_ou_template:
+        return None
+    return private_ou_template.format(user_id=current_user.id)
+
+
+def is_private_dn(dn):
+    """Checks whether a DN lives directly in the current user's private OU."""
+    private_ou = get_private_ou()
+    if not private_ou:
+        return False
+    parent_dn = ",".join(to_dn(dn, remove_space=True)[1:])
+    return parent_dn.lower() == ",".join(to_dn(private_ou, remove_space=True)).lower()
 
+
+def get_private_contacts():
+    """Gets the private contacts of the current user straight from LDAP."""
+    user_ou = get_private_ou()
+    if not user_ou:
+        return []
+
+    person_attrs = get_list_attributes(current_app.config)
+    private_contacts = search_ldap("(objectClass=*)", person_attrs, search_base=user_ou)
     for contact in private_contacts:
+        prepare_contact(contact)
         contact["is_private"] = True
+    return private_contacts
+
+
+def get_visible_contacts():
+    """Gets all contacts visible to the current user (public + their private)."""
+    public_contacts = cache.get("all_people") or []
+    private_contacts = get_private_contacts()
 
     all_contacts_dict = {p["dn"]: p for p in private_contacts + public_contacts}
     return list(all_contacts_dict.values())
 
 
+def get_contact_name(dn):
+    """
+    Gets the full name of a contact, from the cache when possible so that
+    no extra LDAP round-trip is needed. Falls back to LDAP for contacts
+    that aren't cached, such as private ones.
+    """
+    name = (cache.get("contact_names") or {}).get(dn)
+    if name is None:
+        entry = get_entry_by_dn(dn, ["cn"])
+        if entry:
+            name = entry.get("cn", [None])[0]
+    return name
+
+
+def get_company_names():
+    """Gets the sorted names of all companies visible to the current user."""
+    company_names = cache.get("company_names") or []
+
+    company_link_attr = get_config("LDAP_COMPANY_LINK_ATTRIBUTE")
+    private_names = {p[company_link_attr][0] for p in get_private_contacts() if p.get(company_link_attr)}
+    if private_names:
+        company_names = sorted(private_names.union(company_names))
+    return company_names
+
+
+def get_company_employees(company_name):
+    """
+    Gets the visible contacts of a company, sorted by surname. Public contacts
+    come from the company index built at cache refresh time.
+    """
+    company_index = cache.get("company_index") or {}
+    employees = company_index.get(company_name, [])
+
+    company_link_attr = get_config("LDAP_COMPANY_LINK_ATTRIBUTE")
+    private_employees = [p for p in get_private_contacts() if (p.get(company_link_attr) or [None])[0] == company_name]
+    if private_employees:
+        employees = sort_by_surname(private_employees + employees)
+    return employees
+
+
 def _map_google_contact_to_ldap(person):
     """Maps a Google People API person object to an LDAP attribute dictionary."""
     attributes = {}
@@ -276,6 +415,7 @@ def generate_import_stream(token, app, user_id, privacy):  # pylint: disable=too
                     attributes["uid"] = uid
                     new_dn = f"uid={uid},{base}"
                     if add_ldap_entry(new_dn, object_classes, {k: v for k, v in attributes.items() if v}):
+                        forget_missing_dn(new_dn)
                         imported_count += 1
                         msg = f"Successfully imported: {attributes['cn']}"
                     else:
@@ -285,7 +425,7 @@ def generate_import_stream(token, app, user_id, privacy):  # pylint: disable=too
 
     if imported_count > 0:
         with app.app_context():
-            scheduler.add_job(func=refresh_ldap_cache, args=[app], id="manual_refresh_import", replace_existing=True)
+            schedule_cache_refresh(app)
 
     final_msg = f"Import complete. Added {imported_count}, skipped {skipped_count}."
     yield f"data: {json.dumps({'status': 'complete', 'message': final_msg})}\n\n"
@@ -16,16 +16,25 @@
 # Version: 0.37
 
 import base64
-import time
 import uuid
 
-import requests
 from authlib.integrations.base_client.errors import OAuthError
-from flask import Response, abort, current_app, flash, redirect, render_template, request, session, url_for
+from flask import (
+    Response,
+    abort,
+    current_app,
+    flash,
+    make_response,
+    redirect,
+    render_template,
+    request,
+    session,
+    url_for,
+)
 from flask_login import current_user, login_required
 from requests.exceptions import RequestException
 
-from app import oauth, scheduler
+from app import cache, oauth
 from app.ldap_utils import (
     add_ldap_entry,
     delete_ldap_contact,
@@ -35,20 +44,74 @@ from app.ldap_utils import (
     move_ldap_entry,
 )
 from app.main import bp
-from app.main.avatar_generator import generate_avatar
+from app.main.avatar_generator import get_cached_avatar
 from app.main.countries import countries
 from app.main.helpers import (
+    MISSING_DN_CACHE_TIMEOUT,
     build_ldap_changes,
+    decode_b64_or_404,
     editor_required,
     filter_and_sort_people,
+    forget_missing_dn,
     generate_import_stream,
+    geocode_address,
+    get_company_employees,
+    get_company_names,
     get_config,
+    get_contact_name,
     get_index_request_args,
-    get_pagination_params,
+    get_private_ou,
     get_visible_contacts,
-    refresh_ldap_cache,
+    is_private_dn,
+    missing_dn_key,
+    paginate,
+    schedule_cache_refresh,
 )
 
+COMPANIES_PAGE_SIZE = 20
+ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+_NOT_FOUND = object()
+
+
+def _get_entry_or_404(dn, attributes):
+    """
+    Fetches an entry from LDAP or aborts with a 404. Misses are remembered
+    for a short while, so stale links and crawlers don't hit the directory
+    over and over for entries that don't exist.
+    """
+    missing_key = missing_dn_key(dn)
+    if cache.get(missing_key):
+        abort(404)
+    entry = get_entry_by_dn(dn, attributes, not_found=_NOT_FOUND)
+    if entry is _NOT_FOUND:
+        cache.set(missing_key, True, timeout=MISSING_DN_CACHE_TIMEOUT)
+        abort(404)
+    if not entry:
+        abort(404)
+    return entry
+
+
+def _conditional_response(html):
+    """
+    Wraps a rendered page in a response with an ETag, so a browser that
+    revalidates a page it already has gets an empty 304 instead of the body.
+    """
+    response = make_response(html)
+    response.add_etag()
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def _company_employees_or_404(b64_company_name):
+    """Decodes a company name from the URL and returns it with its employees, or aborts with a 404."""
+    company_name = decode_b64_or_404(b64_company_name)
+    employees = get_company_employees(company_name)
+    if not employees:
+        abort(404)
+    return company_name, employees
+
 
 @bp.route("/")
 @login_required
@@ -57,14 +120,8 @@ def index():
     args = get_index_request_args()
     all_visible_contacts = get_visible_contacts()
     filtered_people = filter_and_sort_people(all_visible_contacts, args)
-    print(f"------\nIs admin: {current_user.is_admin}\n------")
     total_people = len(filtered_people)
-    start_index = (args["page"] - 1) * args["page_size"]
-    end_index = start_index + args["page_size"]
-    people_on_page = filtered_people[start_index:end_index]
-
-    page_numbers, total_pages = get_pagination_params(total_people, args["page"], args["page_size"])
-    alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    people_on_page, page_numbers, total_pages = paginate(filtered_people, args["page"], args["page_size"])
 
     return render_template(
         "index.html",
@@ -78,7 +135,7 @@ def index():
         page_numbers=page_numbers,
         sort_by=args["sort_by"],
         sort_order=args["sort_order"],
-        alphabet=alphabet,
+        alphabet=ALPHABET,
         letter=args["letter"],
         current_user=current_user,
     )
@@ -89,29 +146,12 @@ def index():
 def all_companies():
     """Displays a list of unique company names derived from the contacts."""
     args = get_index_request_args()
-    all_visible_contacts = get_visible_contacts()
-    company_link_attr = current_app.config["LDAP_COMPANY_LINK_ATTRIBUTE"]
-
-    company_names = sorted(
-        list(
-            set(
-                p[company_link_attr][0]
-                for p in all_visible_contacts
-                if p.get(company_link_attr) and p[company_link_attr]
-            )
-        )
-    )
+    company_names = get_company_names()
 
     if args["letter"]:
         company_names = [name for name in company_names if name.upper().startswith(args["letter"])]
 
-    total_companies = len(company_names)
-    start_index = (args["page"] - 1) * 20
-    end_index = start_index + 20
-    companies_on_page = company_names[start_index:end_index]
-
-    page_numbers, total_pages = get_pagination_params(total_companies, args["page"], 20)
-    alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    companies_on_page, page_numbers, total_pages = paginate(company_names, args["page"], COMPANIES_PAGE_SIZE)
 
     return render_template(
         "all_companies.html",
@@ -120,7 +160,7 @@ def all_companies():
         page=args["page"],
         total_pages=total_pages,
         page_numbers=page_numbers,
-        alphabet=alphabet,
+        alphabet=ALPHABET,
         letter=args["letter"],
     )
 
@@ -129,20 +169,15 @@ def all_companies():
 @login_required
 def company_detail(b64_company_name):
     """Displays a list of people belonging to a specific company."""
-    company_name = base64.urlsafe_b64decode(b64_company_name).decode()
-    all_visible_contacts = get_visible_contacts()
-    company_link_attr = current_app.config["LDAP_COMPANY_LINK_ATTRIBUTE"]
-
-    employees = [
-        p for p in all_visible_contacts if p.get(company_link_attr) and p[company_link_attr][0] == company_name
-    ]
-    employees.sort(key=lambda p: (p.get("sn")[0] if p.get("sn") else "").lower())
-
-    return render_template(
-        "company_detail.html",
-        title=f"Company: {company_name}",
-        company_name=company_name,
-        employees=employees,
+    company_name, employees = _company_employees_or_404(b64_company_name)
+
+    return _conditional_response(
+        render_template(
+            "company_detail.html",
+            title=f"Company: {company_name}",
+            company_name=company_name,
+            employees=employees,
+        )
     )
 
 
@@ -150,21 +185,12 @@ def company_detail(b64_company_name):
 @login_required
 def company_orgchart(b64_company_name):
     """Displays an org chart for a specific company."""
-    company_name = base64.urlsafe_b64decode(b64_company_name).decode()
-    all_visible_contacts = get_visible_contacts()
-    company_link_attr = current_app.config["LDAP_COMPANY_LINK_ATTRIBUTE"]
-
-    employees = [
-        p for p in all_visible_contacts if p.get(company_link_attr) and p[company_link_attr][0] == company_name
-    ]
+    company_name, employees = _company_employees_or_404(b64_company_name)
 
     employees_for_json = []
     for employee in employees:
-        avatar_url = None
-        if "jpegPhoto" in employee and employee["jpegPhoto"] and employee["jpegPhoto"][0]:
-            photo_data = base64.b64encode(employee["jpegPhoto"][0]).decode("utf-8")
-            avatar_url = f"data:image/jpeg;base64,{photo_data}"
-        elif current_app.config["ENABLE_GENERATED_AVATARS"]:
+        avatar_url = employee.get("_avatar_data_url")
+        if not avatar_url and current_app.config["ENABLE_GENERATED_AVATARS"]:
             avatar_url = url_for("main.avatar", seed=employee["dn"], _external=True)
 
         clean_employee = {
@@ -188,13 +214,7 @@ def company_orgchart(b64_company_name):
 @login_required
 def company_cards(b64_company_name):
     """Displays a grid of cards for people belonging to a specific company."""
-    company_name = base64.urlsafe_b64decode(b64_company_name).decode()
-    all_visible_contacts = get_visible_contacts()
-    company_link_attr = current_app.config["LDAP_COMPANY_LINK_ATTRIBUTE"]
-
-    employees = [
-        p for p in all_visible_contacts if p.get(company_link_attr) and p[company_link_attr][0] == company_name
-    ]
+    company_name, employees = _company_employees_or_404(b64_company_name)
 
     return render_template(
         "company_cards.html",
@@ -208,11 +228,9 @@ def company_cards(b64_company_name):
 @login_required
 def person_detail(b64_dn):
     """Displays details for a single person."""
-    dn = base64.urlsafe_b64decode(b64_dn).decode()
+    dn = decode_b64_or_404(b64_dn)
     person_attrs = current_app.config["LDAP_PERSON_ATTRIBUTES"]
-    person = get_entry_by_dn(dn, person_attrs)
-    if not person:
-        abort(404)
+    person = _get_entry_or_404(dn, person_attrs)
 
     if "jpegPhoto" in person and person["jpegPhoto"] and person["jpegPhoto"][0]:
         person["jpegPhoto"][0] = base64.b64encode(person["jpegPhoto"][0]).decode("utf-8")
@@ -221,27 +239,23 @@ def person_detail(b64_dn):
 
     manager_name = None
     if "manager" in person and person["manager"]:
-        manager = get_entry_by_dn(person["manager"][0], ["cn"])
-        if manager:
-            manager_name = manager.get("cn", [None])[0]
+        manager_name = get_contact_name(person["manager"][0])
 
     person_for_json = person.copy()
 
-    back_params = {k: v for k, v in request.args.items() if v is not None}
-
-    private_ou_template = current_app.config["LDAP_PRIVATE_OU_TEMPLATE"]
-    is_private = private_ou_template and f"ou=user_{current_user.id}" in dn
-
-    return render_template(
-        "person_detail.html",
-        title=person_name,
-        person=person,
-        person_for_json=person_for_json,
-        b64_dn=b64_dn,
-        back_params=back_params,
-        manager_name=manager_name,
-        countries=countries,
-        is_private=is_private,
+    is_private = is_private_dn(dn)
+
+    return _conditional_response(
+        render_template(
+            "person_detail.html",
+            title=person_name,
+            person=person,
+            person_for_json=person_for_json,
+            b64_dn=b64_dn,
+            manager_name=manager_name,
+            countries=countries,
+            is_private=is_private,
+        )
     )
 
 
@@ -249,27 +263,15 @@ def person_detail(b64_dn):
 @login_required
 def person_map(b64_dn):
     """Displays the location of a person on a map."""
-    dn = base64.urlsafe_b64decode(b64_dn).decode()
-    person = get_entry_by_dn(dn, ["cn", "street", "l", "postalCode", "c"])
-    if not person:
-        abort(404)
+    dn = decode_b64_or_404(b64_dn)
+    person = _get_entry_or_404(dn, ["cn", "street", "l", "postalCode", "c"])
 
     latitude, longitude = None, None
     address_parts = [(person.get(k) or [""])[0] for k in ["street", "l", "postalCode", "c"]]
     full_address = ", ".join(filter(None, address_parts))
 
     if full_address:
-        try:
-            url = f"https://nominatim.openstreetmap.org/search?format=json&q={full_address}"
-            headers = {"User-Agent": "BlackbookAddressBook/1.0"}
-            response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            if data:
-                latitude = data[0]["lat"]
-                longitude = data[0]["lon"]
-        except requests.exceptions.RequestException as e:
-            print(f"Could not connect to OpenStreetMap API: {e}")
+        latitude, longitude = geocode_address(full_address)
 
     return render_template(
         "person_map.html",
@@ -285,23 +287,27 @@ def person_map(b64_dn):
 @login_required
 def person_vcard(b64_dn):
     """Generates and returns a vCard file for a person."""
-    dn = base64.urlsafe_b64decode(b64_dn).decode()
-    person = get_entry_by_dn(dn, current_app.config["LDAP_PERSON_ATTRIBUTES"])
-    if not person:
-        abort(404)
+    dn = decode_b64_or_404(b64_dn)
+    person = _get_entry_or_404(dn, current_app.config["LDAP_PERSON_ATTRIBUTES"])
 
     def get_val(attr):
         return (person.get(attr) or [""])[0]
 
-    vcard = f"""BEGIN:VCARD
-VERSION:3.0
-FN:{get_val("cn")}
-N:{get_val("sn")};{get_val("givenName")};;;
-ORG:{get_val("o")}
-EMAIL;TYPE=WORK,INTERNET:{get_val("mail")}
-TEL;TYPE=WORK,VOICE:{get_val("telephoneNumber")}
-ADR;TYPE=WORK:;;{get_val("street")};{get_val("l")};;{get_val("postalCode")};
-END:VCARD"""
+    # vCard lines are CRLF terminated (RFC 2426).
+    vcard = "\r\n".join(
+        [
+            "BEGIN:VCARD",
+            "VERSION:3.0",
+            f"FN:{get_val('cn')}",
+            f"N:{get_val('sn')};{get_val('givenName')};;;",
+            f"ORG:{get_val('o')}",
+            f"EMAIL;TYPE=WORK,INTERNET:{get_val('mail')}",
+            f"TEL;TYPE=WORK,VOICE:{get_val('telephoneNumber')}",
+            f"ADR;TYPE=WORK:;;{get_val('street')};{get_val('l')};;{get_val('postalCode')};",
+            "END:VCARD",
+            "",
+        ]
+    )
 
     filename = f"{get_val('cn').replace(' ', '_')}.vcf"
     return Response(vcard, mimetype="text/vcard", headers={"Content-disposition": f"attachment; filename={filename}"})
@@ -337,13 +343,9 @@ def add_person():
         object_classes = current_app.config["LDAP_PERSON_OBJECT_CLASS"].split(",")
 
         if add_ldap_entry(new_dn, object_classes, attributes):
+            forget_missing_dn(new_dn)
             flash("Contact added successfully! The list will refresh shortly.", "success")
-            scheduler.add_job(
-                func=refresh_ldap_cache,
-                args=[current_app._get_current_object()],  # pylint: disable=protected-access
-                id="manual_refresh_add",
-                replace_existing=True,
-            )
+            schedule_cache_refresh()
             return redirect(url_for("main.index"))
         return redirect(url_for("main.add_person"))
 
@@ -357,22 +359,15 @@ def add_person():
 @editor_required
 def edit_person(b64_dn):
     """Handles editing of a person entry."""
-    dn = base64.urlsafe_b64decode(b64_dn).decode()
+    dn = decode_b64_or_404(b64_dn)
     person_attrs = current_app.config["LDAP_PERSON_ATTRIBUTES"]
-    current_person = get_entry_by_dn(dn, person_attrs)
-    if not current_person:
-        abort(404)
+    current_person = _get_entry_or_404(dn, person_attrs)
 
     potential_managers = []
     company_link_attr = get_config("LDAP_COMPANY_LINK_ATTRIBUTE")
     person_company = (current_person.get(company_link_attr) or [None])[0]
     if person_company:
-        all_people = get_visible_contacts() or []
-        potential_managers = [
-            p
-            for p in all_people
-            if p.get(company_link_attr) and p[company_link_attr][0] == person_company and p["dn"] != dn
-        ]
+        potential_managers = [p for p in get_company_employees(person_company) if p["dn"] != dn]
 
     if request.method == "POST":
         changes = build_ldap_changes(request.form, current_person, person_attrs)
@@ -380,12 +375,7 @@ def edit_person(b64_dn):
             flash("No changes were submitted.", "info")
         elif modify_ldap_entry(dn, changes):
             flash("Person details updated successfully! The list will refresh shortly.", "success")
-            scheduler.add_job(
-                func=refresh_ldap_cache,
-                args=[current_app._get_current_object()],  # pylint: disable=protected-access
-                id="manual_refresh_edit",
-                replace_existing=True,
-            )
+            schedule_cache_refresh()
         return redirect(url_for("main.person_detail", b64_dn=b64_dn))
 
     person_name = current_person.get("cn", ["Unknown"])[0]
@@ -404,15 +394,10 @@ def edit_person(b64_dn):
 @editor_required
 def delete_person(b64_dn):
     """Handles deletion of a person entry."""
-    dn = base64.urlsafe_b64decode(b64_dn).decode()
+    dn = decode_b64_or_404(b64_dn)
     if delete_ldap_contact(dn):
         flash("Contact deleted successfully! The list will refresh shortly.", "success")
-        scheduler.add_job(
-            func=refresh_ldap_cache,
-            args=[current_app._get_current_object()],  # pylint: disable=protected-access
-            id="manual_refresh_delete",
-            replace_existing=True,
-        )
+        schedule_cache_refresh()
     else:
         flash("Failed to delete contact.", "danger")
     return redirect(url_for("main.index"))
@@ -421,7 +406,12 @@ def delete_person(b64_dn):
 @bp.route("/avatar/<seed>.svg")
 def avatar(seed):
     """Generates and returns an avatar SVG."""
-    return Response(generate_avatar(seed=seed, theme=current_app.config["AVATAR_THEME"]), mimetype="image/svg+xml")
+    svg, etag = get_cached_avatar(seed, current_app.config["AVATAR_THEME"])
+    response = Response(svg, mimetype="image/svg+xml")
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = 86400
+    return response.make_conditional(request)
 
 
 @bp.route("/import/google")
@@ -486,24 +476,19 @@ def import_stream():
 @editor_required
 def toggle_contact_privacy(b64_dn):
     """Moves a contact between public and private OUs."""
-    old_dn = base64.urlsafe_b64decode(b64_dn).decode()
+    old_dn = decode_b64_or_404(b64_dn)
     public_ou = current_app.config["LDAP_CONTACTS_DN"]
-    private_ou = current_app.config["LDAP_PRIVATE_OU_TEMPLATE"].format(user_id=current_user.id)
+    private_ou = get_private_ou()
 
-    new_parent_dn = public_ou if private_ou in old_dn else private_ou
+    new_parent_dn = public_ou if is_private_dn(old_dn) else private_ou
     if new_parent_dn == private_ou:
         ensure_ou_exists(private_ou)
 
     if move_ldap_entry(old_dn, new_parent_dn):
         flash("Contact privacy updated. The list will refresh shortly.", "success")
-        scheduler.add_job(
-            func=refresh_ldap_cache,
-            args=[current_app._get_current_object()],  # pylint: disable=protected-access
-            id=f"manual_refresh_move_{uuid.uuid4()}",
-            replace_existing=False,
-        )
-        time.sleep(1)
+        schedule_cache_refresh()
         rdn = old_dn.split(",")[0]
         new_dn = f"{rdn},{new_parent_dn}"
+        forget_missing_dn(new_dn)
         return redirect(url_for("main.person_detail", b64_dn=base64.urlsafe_b64encode(new_dn.encode()).decode()))
     return redirect(url_for("main.person_detail", b64_dn=b64_dn))
@@ -110,10 +110,9 @@ class User(UserMixin, db.Model):
     @staticmethod
     def verify_reset_password_token(token):
         """Verifies a token and checks if it has expired."""
-        user = User.query.filter_by(password_reset_token=token).first()
-        if user is None or user.password_reset_expiration < datetime.now(timezone.utc):
-            return None
-        return user
+        return User.query.filter(
+            User.password_reset_token == token, User.password_reset_expiration > datetime.now(timezone.utc)
+        ).first()
 
     def __repr__(self):
         return f"<User {self.username}>"
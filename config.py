@@ -22,17 +22,33 @@ import os
 from dotenv import load_dotenv
 
 basedir = os.path.abspath(os.path.dirname(__file__))
-load_dotenv(os.path.join(basedir, ".env"))
+# The test suite sets BLACKBOOK_SKIP_DOTENV so a local .env can't change its configuration.
+if not os.environ.get("BLACKBOOK_SKIP_DOTENV"):
+    load_dotenv(os.path.join(basedir, ".env"))
+
+
+TRUE_VALUES = frozenset(("true", "1", "t"))
+
+
+def env_bool(name, default=False):
+    """Reads a boolean setting from the environment."""
+    value = os.environ.get(name)
+    return default if value is None else value.lower() in TRUE_VALUES
+
+
+def split_csv(value):
+    """Splits a comma-separated setting into its stripped, non-empty items."""
+    return [item.strip() for item in value.split(",") if item.strip()]
 
 
 class Config:
     """Base config."""
 
     SECRET_KEY = os.environ.get("SECRET_KEY", "you-will-never-guess")
-    FLASK_DEBUG = os.environ.get("FLASK_DEBUG", "False").lower() in ("true", "1", "t")
+    FLASK_DEBUG = env_bool("FLASK_DEBUG")
     SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL", "sqlite:///" + os.path.join(basedir, "app.db"))
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    READONLY = os.environ.get("READONLY", "False").lower() in ("true", "1", "t")
+    READONLY = env_bool("READONLY")
     APP_TITLE = os.environ.get("APP_TITLE", "Blackbook")
 
     # --- LDAP Configuration ---
@@ -45,7 +61,11 @@ class Config:
     LDAP_USER_DN_TEMPLATE = os.environ.get("LDAP_USER_DN_TEMPLATE", "uid={username},ou=users,dc=example,dc=com")
     LDAP_CONTACT_DN_TEMPLATE = os.environ.get("LDAP_CONTACT_DN_TEMPLATE", "cn={cn},ou=contacts,dc=example,dc=com")
     LDAP_PRIVATE_OU_TEMPLATE = os.environ.get("LDAP_PRIVATE_OU_TEMPLATE", "ou=user_{user_id},dc=example,dc=com")
-    LDAP_USE_SSL = os.environ.get("LDAP_USE_SSL", "False").lower() in ("true", "1", "t")
+    LDAP_USE_SSL = env_bool("LDAP_USE_SSL")
+    # Number of idle bound connections kept around for read-only searches.
+    LDAP_POOL_SIZE = int(os.environ.get("LDAP_POOL_SIZE", 10))
+    # Pooled connections idle for longer than this many seconds are dropped instead of reused.
+    LDAP_POOL_IDLE_TIMEOUT = int(os.environ.get("LDAP_POOL_IDLE_TIMEOUT", 60))
 
     # Filter to apply when searching for contacts
     ADDRESSBOOK_FILTER = os.environ.get("ADDRESSBOOK_FILTER")
@@ -65,25 +85,33 @@ class Config:
         "telephoneNumber:Phone,o:Company,title:Title,street:Street,"
         "l:City,postalCode:Postal Code,c:Country,manager:Manager,jpegPhoto:Photo",
     )
-    LDAP_ATTRIBUTE_MAP = dict(item.split(":") for item in LDAP_ATTRIBUTE_MAP_STR.split(","))
+    # partition() splits on the first colon only, so labels may contain colons.
+    LDAP_ATTRIBUTE_MAP = {
+        attr.strip(): label.strip()
+        for attr, _, label in (item.partition(":") for item in split_csv(LDAP_ATTRIBUTE_MAP_STR))
+    }
     LDAP_PERSON_ATTRIBUTES = list(LDAP_ATTRIBUTE_MAP.keys())
 
     # --- Authentication Configuration ---
-    ENABLE_LOCAL_LOGIN = os.environ.get("ENABLE_LOCAL_LOGIN", "True").lower() in ("true", "1", "t")
-    ENABLE_LDAP_LOGIN = os.environ.get("ENABLE_LDAP_LOGIN", "True").lower() in ("true", "1", "t")
+    ENABLE_LOCAL_LOGIN = env_bool("ENABLE_LOCAL_LOGIN", True)
+    ENABLE_LDAP_LOGIN = env_bool("ENABLE_LDAP_LOGIN", True)
 
     # --- Feature Toggles ---
-    ENABLE_GOOGLE_CONTACTS_IMPORT = os.environ.get("ENABLE_GOOGLE_CONTACTS_IMPORT", "False").lower() in (
-        "true",
-        "1",
-        "t",
-    )
+    ENABLE_GOOGLE_CONTACTS_IMPORT = env_bool("ENABLE_GOOGLE_CONTACTS_IMPORT")
     LDAP_OWNER_ATTRIBUTE = os.environ.get("LDAP_OWNER_ATTRIBUTE", "employeeNumber")
 
     # Ensure the owner attribute is always fetched from LDAP for filtering
     if LDAP_OWNER_ATTRIBUTE not in LDAP_PERSON_ATTRIBUTES:
         LDAP_PERSON_ATTRIBUTES.append(LDAP_OWNER_ATTRIBUTE)
 
+    # Optional comma-separated subset of attributes to cache for the list pages.
+    # Defaults to all person attributes; detail and edit pages always fetch the full set.
+    LDAP_PERSON_LIST_ATTRIBUTES_STR = os.environ.get("LDAP_PERSON_LIST_ATTRIBUTES")
+    if LDAP_PERSON_LIST_ATTRIBUTES_STR:
+        LDAP_PERSON_LIST_ATTRIBUTES = split_csv(LDAP_PERSON_LIST_ATTRIBUTES_STR)
+    else:
+        LDAP_PERSON_LIST_ATTRIBUTES = LDAP_PERSON_ATTRIBUTES
+
     LDAP_ADMIN_GROUP_DN = os.environ.get("LDAP_ADMIN_GROUP_DN")
     LDAP_EDITOR_GROUP_DN = os.environ.get("LDAP_EDITOR_GROUP_DN")
 
@@ -107,23 +135,22 @@ class Config:
     AUTHENTIK_EDITOR_GROUP = os.environ.get("AUTHENTIK_EDITOR_GROUP")
 
     # --- Caching Configuration ---
-    CACHE_TYPE = "SimpleCache"
+    # SimpleCache is per process. Use RedisCache (with CACHE_REDIS_URL) to share
+    # the contact cache between gunicorn workers.
+    CACHE_TYPE = os.environ.get("CACHE_TYPE", "SimpleCache")
+    CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL")
     CACHE_DEFAULT_TIMEOUT = int(os.environ.get("CACHE_DEFAULT_TIMEOUT", 300))
     CACHE_REFRESH_INTERVAL = int(os.environ.get("CACHE_REFRESH_INTERVAL", 300))
 
     # --- Avatar Generation ---
-    ENABLE_GENERATED_AVATARS = os.environ.get("ENABLE_GENERATED_AVATARS", "False").lower() in (
-        "true",
-        "1",
-        "t",
-    )
+    ENABLE_GENERATED_AVATARS = env_bool("ENABLE_GENERATED_AVATARS")
     AVATAR_THEME = os.environ.get("AVATAR_THEME", "all")
 
     # --- Pagination Configuration ---
     PAGE_SIZE_OPTIONS_STR = os.environ.get("PAGE_SIZE_OPTIONS", "20,30,50")
     try:
-        PAGE_SIZE_OPTIONS = [int(s.strip()) for s in PAGE_SIZE_OPTIONS_STR.split(",")]
-    except (ValueError, IndexError):
+        PAGE_SIZE_OPTIONS = [int(size) for size in split_csv(PAGE_SIZE_OPTIONS_STR)] or [20, 30, 50]
+    except ValueError:
         print("WARNING: PAGE_SIZE_OPTIONS is malformed. Using default.")
         PAGE_SIZE_OPTIONS = [20, 30, 50]
 
@@ -17,13 +17,22 @@
 # Author: Taco Scheltema https://github.com/TacoScheltema/blackbook
 #
 
+import os
 from unittest.mock import MagicMock
 
 import pytest
+from werkzeug.security import generate_password_hash
 
-from app import create_app, db
-from app.models import User
-from config import Config
+# Must be set before config.py is imported.
+os.environ.setdefault("BLACKBOOK_SKIP_DOTENV", "1")
+
+from app import create_app, db  # noqa: E402
+from app.models import User  # noqa: E402
+from config import Config  # noqa: E402
+
+# Hash the shared test password once instead of in every user fixture. A single
+# PBKDF2 iteration keeps every login in the tests from paying for a real work factor.
+PASSWORD_HASH = generate_password_hash("password", method="pbkdf2:sha256:1")
 
 
 class TestConfig(Config):
@@ -56,7 +65,7 @@ def client(app):
 def test_user(app):
     """Create a test user."""
     user = User(username="testuser", email="test@test.com", is_editor=False)
-    user.set_password("password")
+    user.password_hash = PASSWORD_HASH
     db.session.add(user)
     db.session.commit()
     return user
@@ -66,7 +75,7 @@ def test_user(app):
 def editor_user(app):
     """Create an editor user."""
     user = User(username="editoruser", email="editor@test.com", is_editor=True)
-    user.set_password("password")
+    user.password_hash = PASSWORD_HASH
     db.session.add(user)
     db.session.commit()
     return user
@@ -76,12 +85,21 @@ def editor_user(app):
 def admin_user(app):
     """Create an admin user."""
     user = User(username="adminuser", email="admin@test.com", is_admin=True)
-    user.set_password("password")
+    user.password_hash = PASSWORD_HASH
     db.session.add(user)
     db.session.commit()
     return user
 
 
+@pytest.fixture(autouse=True)
+def fast_password_hash(mocker):
+    """Hash passwords the app sets during tests with a single PBKDF2 iteration."""
+    mocker.patch(
+        "app.models.generate_password_hash",
+        side_effect=lambda password: generate_password_hash(password, method="pbkdf2:sha256:1"),
+    )
+
+
 @pytest.fixture
 def mock_ldap_connection(mocker):
     """Fixture to mock the LDAP connection."""
@@ -22,12 +22,8 @@ from app.models import User
 
 
 def login(client, username, password):
-    """Helper function to log in a user."""
-    return client.post(
-        "/login",
-        data={"username": username, "password": password, "auth_type": "local"},
-        follow_redirects=True,
-    )
+    """Helper function to log in a user. Doesn't follow the redirect to the index page."""
+    return client.post("/login", data={"username": username, "password": password, "auth_type": "local"})
 
 
 def test_admin_users_page_as_admin(client, admin_user):
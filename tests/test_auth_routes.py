@@ -17,8 +17,12 @@
 # Author: Taco Scheltema https://github.com/TacoScheltema/blackbook
 #
 
+from datetime import datetime, timedelta, timezone
 from unittest.mock import MagicMock
 
+from flask import redirect
+
+from app import db
 from app.models import User
 
 
@@ -116,16 +120,37 @@ def test_reset_password_token(client, test_user):
     assert b"Reset Your Password" in response.data
 
 
-def test_sso_login(client):
+def test_expired_reset_password_token(app, test_user):
+    """
+    GIVEN a user whose reset token has expired
+    WHEN the token is verified
+    THEN check that no user is returned
+    """
+    with app.app_context():
+        user = db.session.get(User, test_user.id)
+        token = user.get_reset_password_token()
+        assert User.verify_reset_password_token(token) == user
+        user.password_reset_expiration = datetime.now(timezone.utc) - timedelta(minutes=1)
+        db.session.commit()
+        assert User.verify_reset_password_token(token) is None
+
+
+def test_sso_login(client, mocker):
     """
     GIVEN a Flask application with SSO configured
     WHEN the SSO login route is accessed
     THEN check that it redirects to the provider
     """
-    # This test assumes Google SSO is configured in TestConfig
+    # The OAuth client is mocked so the test doesn't fetch the provider's OIDC metadata.
+    mock_oauth_client = MagicMock()
+    mock_oauth_client.authorize_redirect.return_value = redirect("https://accounts.google.com/o/oauth2/v2/auth")
+    mocker.patch("app.oauth.create_client", return_value=mock_oauth_client)
+
     response = client.get("/login/google")
     assert response.status_code == 302
     assert "accounts.google.com" in response.location
+    redirect_uri = mock_oauth_client.authorize_redirect.call_args.args[0]
+    assert redirect_uri.endswith("/authorize/google")
 
 
 def test_sso_authorize(client, mocker):
@@ -0,0 +1,34 @@
+# This file is part of Blackbook.
+#
+# Blackbook is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Blackbook is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Blackbook.  If not, see <https://www.gnu.org/licenses/>.
+
+#
+# Author: Taco Scheltema https://github.com/TacoScheltema/blackbook
+#
+
+import random
+
+from app.main.avatar_generator import generate_avatar
+
+
+def test_generate_avatar_leaves_global_random_alone():
+    """
+    GIVEN a seeded avatar
+    WHEN it is generated twice
+    THEN check that both renders match and the module-global random state is untouched
+    """
+    state = random.getstate()
+
+    assert generate_avatar(seed="test-seed") == generate_avatar(seed="test-seed")
+    assert random.getstate() == state
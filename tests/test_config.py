@@ -0,0 +1,74 @@
+# This file is part of Blackbook.
+#
+# Blackbook is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Blackbook is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Blackbook.  If not, see <https://www.gnu.org/licenses/>.
+
+#
+# Author: Taco Scheltema https://github.com/TacoScheltema/blackbook
+#
+
+import importlib.util
+
+import config
+
+
+def load_config(monkeypatch, **environ):
+    """Helper to evaluate a fresh copy of config.py with the given environment variables set."""
+    for name, value in environ.items():
+        monkeypatch.setenv(name, value)
+    spec = importlib.util.spec_from_file_location("fresh_config", config.__file__)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.Config
+
+
+def test_attribute_map_label_may_contain_colon(monkeypatch):
+    """
+    GIVEN an LDAP_ATTRIBUTE_MAP with a label that contains a colon
+    WHEN the configuration is loaded
+    THEN check that only the first colon separates the attribute from its label
+    """
+    app_config = load_config(monkeypatch, LDAP_ATTRIBUTE_MAP="cn:Full Name, labeledURI:Website: URL")
+
+    assert app_config.LDAP_ATTRIBUTE_MAP == {"cn": "Full Name", "labeledURI": "Website: URL"}
+
+
+def test_comma_separated_settings_ignore_trailing_commas(monkeypatch):
+    """
+    GIVEN comma-separated settings with stray spaces and trailing commas
+    WHEN the configuration is loaded
+    THEN check that empty items are dropped
+    """
+    app_config = load_config(
+        monkeypatch,
+        LDAP_ATTRIBUTE_MAP="cn:Full Name,mail:Email,",
+        LDAP_PERSON_LIST_ATTRIBUTES=" cn, mail,,",
+        PAGE_SIZE_OPTIONS="10, 25,",
+    )
+
+    assert app_config.LDAP_ATTRIBUTE_MAP == {"cn": "Full Name", "mail": "Email"}
+    assert app_config.LDAP_PERSON_LIST_ATTRIBUTES == ["cn", "mail"]
+    assert app_config.PAGE_SIZE_OPTIONS == [10, 25]
+    assert app_config.DEFAULT_PAGE_SIZE == 10
+
+
+def test_empty_page_size_options_fall_back_to_default(monkeypatch):
+    """
+    GIVEN an empty PAGE_SIZE_OPTIONS setting
+    WHEN the configuration is loaded
+    THEN check that the default page sizes are used
+    """
+    app_config = load_config(monkeypatch, PAGE_SIZE_OPTIONS="")
+
+    assert app_config.PAGE_SIZE_OPTIONS == [20, 30, 50]
+    assert app_config.DEFAULT_PAGE_SIZE == 20
@@ -0,0 +1,89 @@
+# This file is part of Blackbook.
+#
+# Blackbook is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Blackbook is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Blackbook.  If not, see <https://www.gnu.org/licenses/>.
+
+#
+# Author: Taco Scheltema https://github.com/TacoScheltema/blackbook
+#
+
+import uuid
+
+import requests
+
+from app import cache
+from app.main.helpers import generate_import_stream, geocode_address, is_private_dn, missing_dn_key
+
+
+def test_geocode_address(app, mocker):
+    """
+    GIVEN Nominatim returns a match for an address
+    WHEN the address is geocoded
+    THEN check that the address is sent as a query parameter and the coordinates are returned
+    """
+    mock_get = mocker.patch("app.main.helpers._http.get")
+    mock_get.return_value.json.return_value = [{"lat": "52.37", "lon": "4.89"}]
+
+    with app.app_context():
+        assert geocode_address("Dam 1, Amsterdam") == ("52.37", "4.89")
+
+    assert mock_get.call_args.kwargs["params"]["q"] == "Dam 1, Amsterdam"
+
+
+def test_geocode_address_connection_error(app, mocker):
+    """
+    GIVEN Nominatim can't be reached
+    WHEN an address is geocoded
+    THEN check that no coordinates are returned
+    """
+    mocker.patch("app.main.helpers._http.get", side_effect=requests.exceptions.ConnectionError("unreachable"))
+
+    with app.app_context():
+        assert geocode_address("Dam 1, Amsterdam") == (None, None)
+
+
+def test_import_forgets_missing_dn(app, mocker):
+    """
+    GIVEN a DN that was remembered as missing
+    WHEN a Google contact is imported at that DN
+    THEN check that the remembered miss is dropped
+    """
+    new_uid = uuid.UUID("12345678-1234-5678-1234-567812345678")
+    new_dn = f"uid={new_uid},{app.config['LDAP_CONTACTS_DN']}"
+    mock_get = mocker.patch("app.main.helpers.requests.get")
+    mock_get.return_value.json.return_value = {"connections": [{"names": [{"displayName": "New User"}]}]}
+    mocker.patch("app.main.helpers.uuid.uuid4", return_value=new_uid)
+    mocker.patch("app.main.helpers.search_ldap", return_value=[])
+    mocker.patch("app.main.helpers.add_ldap_entry", return_value=True)
+    mocker.patch("app.main.helpers.schedule_cache_refresh")
+
+    with app.app_context():
+        cache.set(missing_dn_key(new_dn), True)
+        list(generate_import_stream({"access_token": "token"}, app, 1, "public"))
+        assert cache.get(missing_dn_key(new_dn)) is None
+
+
+def test_is_private_dn(app, mocker):
+    """
+    GIVEN a user with id 1 and the default private OU template
+    WHEN DNs inside and outside their private OU are checked
+    THEN check that only entries directly in 'ou=user_1' count as private
+    """
+    mocker.patch("app.main.helpers.current_user", id=1)
+
+    assert is_private_dn("cn=Test User,ou=user_1,dc=example,dc=com")
+    assert is_private_dn("cn=Smith\\, John,OU=user_1,dc=example,dc=com")
+    assert is_private_dn("cn=A, ou=user_1, dc=example, dc=com")
+    assert not is_private_dn("cn=Test User,ou=user_10,dc=example,dc=com")
+    assert not is_private_dn("cn=Test User,ou=sub,ou=user_1,dc=example,dc=com")
+    assert not is_private_dn("cn=Test User,ou=contacts,dc=example,dc=com")
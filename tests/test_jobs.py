@@ -0,0 +1,125 @@
+# This file is part of Blackbook.
+#
+# Blackbook is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Blackbook is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Blackbook.  If not, see <https://www.gnu.org/licenses/>.
+
+#
+# Author: Taco Scheltema https://github.com/TacoScheltema/blackbook
+#
+
+import threading
+from datetime import datetime, timedelta, timezone
+
+from app import cache, db
+from app.jobs import (
+    _refresh_lock,
+    clear_expired_reset_tokens,
+    get_list_attributes,
+    prepare_contact,
+    refresh_ldap_cache,
+    store_contacts,
+)
+from app.models import User
+
+
+def test_refresh_waits_for_running_refresh(app, mocker):
+    """
+    GIVEN a cache refresh that is already running
+    WHEN a write schedules another refresh in the meantime
+    THEN check that the second refresh waits for the first and then stores fresh results
+    """
+    mock_search = mocker.patch(
+        "app.jobs.search_ldap",
+        return_value=[{"dn": "cn=New User,dc=example,dc=com", "cn": ["New User"], "sn": ["User"]}],
+    )
+
+    with _refresh_lock:
+        pending = threading.Thread(target=refresh_ldap_cache, args=[app])
+        pending.start()
+        pending.join(timeout=0.2)
+        assert pending.is_alive()
+        mock_search.assert_not_called()
+
+    pending.join(timeout=5)
+    assert not pending.is_alive()
+    mock_search.assert_called_once()
+    with app.app_context():
+        assert [p["dn"] for p in cache.get("all_people")] == ["cn=New User,dc=example,dc=com"]
+
+
+def test_list_attributes_include_required(app):
+    """
+    GIVEN a restricted list attribute set
+    WHEN the attributes for the contact cache are resolved
+    THEN check that the attributes needed for grouping, filtering and the org chart are always fetched
+    """
+    app.config["LDAP_PERSON_LIST_ATTRIBUTES"] = ["mail"]
+    attrs = get_list_attributes(app.config)
+    assert attrs[0] == "mail"
+    for attr in (
+        "cn",
+        "sn",
+        "title",
+        "manager",
+        app.config["LDAP_COMPANY_LINK_ATTRIBUTE"],
+        app.config["LDAP_OWNER_ATTRIBUTE"],
+    ):
+        assert attr in attrs
+    assert "jpegPhoto" not in attrs
+
+
+def test_contacts_outlive_refresh_interval(app, mocker):
+    """
+    GIVEN a refresh interval longer than the default cache timeout
+    WHEN the contact list is stored
+    THEN check that the entries are kept for two refresh intervals
+    """
+    app.config["CACHE_REFRESH_INTERVAL"] = 600
+    cache_set = mocker.patch("app.jobs.cache.set")
+    with app.app_context():
+        store_contacts([])
+    assert {c.kwargs["timeout"] for c in cache_set.call_args_list} == {1200}
+
+
+def test_contacts_stored_in_default_order(app):
+    """
+    GIVEN an unordered list of contacts
+    WHEN the list is stored in the cache
+    THEN check that it is kept in the index page's default surname order
+    """
+    sample_people = [
+        {"dn": "cn=Bob Smith,dc=example,dc=com", "cn": ["Bob Smith"], "sn": ["smith"]},
+        {"dn": "cn=Alice Jones,dc=example,dc=com", "cn": ["Alice Jones"], "sn": ["Jones"]},
+    ]
+    with app.app_context():
+        store_contacts([prepare_contact(p) for p in sample_people])
+        assert [p["sn"][0] for p in cache.get("all_people")] == ["Jones", "smith"]
+
+
+def test_clear_expired_reset_tokens(app, test_user):
+    """
+    GIVEN a user with an expired password reset token
+    WHEN the token cleanup job runs
+    THEN check that the token and its expiration are removed
+    """
+    with app.app_context():
+        user = db.session.get(User, test_user.id)
+        user.password_reset_token = "expired-token"
+        user.password_reset_expiration = datetime.now(timezone.utc) - timedelta(hours=1)
+        db.session.commit()
+
+        clear_expired_reset_tokens(app)
+
+        user = db.session.get(User, test_user.id)
+        assert user.password_reset_token is None
+        assert user.password_reset_expiration is None
@@ -0,0 +1,128 @@
+# This file is part of Blackbook.
+#
+# Blackbook is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Blackbook is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Blackbook.  If not, see <https://www.gnu.org/licenses/>.
+
+#
+# Author: Taco Scheltema https://github.com/TacoScheltema/blackbook
+#
+
+from unittest.mock import MagicMock, patch
+
+from ldap3.core.exceptions import LDAPException
+
+from app.ldap_utils import authenticate_ldap_user, escape_filter_value, get_entry_by_dn, search_ldap
+
+
+def test_escape_filter_value():
+    """
+    GIVEN a value containing LDAP filter metacharacters
+    WHEN it is escaped for use in a search filter
+    THEN check that every metacharacter is replaced by its RFC 4515 escape
+    """
+    assert escape_filter_value("a*b(c)\\d\0") == "a\\2ab\\28c\\29\\5cd\\00"
+    assert escape_filter_value("plain value") == "plain value"
+
+
+def test_authenticate_ldap_user_escapes_member_filter(app, mock_ldap_connection):
+    """
+    GIVEN an LDAP admin group is configured
+    WHEN a user whose name contains filter metacharacters authenticates
+    THEN check that the group membership search uses an escaped DN
+    """
+    app.config["LDAP_ADMIN_GROUP_DN"] = "cn=admins,dc=example,dc=com"
+    app.config["LDAP_EDITOR_GROUP_DN"] = None
+    mock_ldap_connection.search.return_value = False
+
+    is_authenticated, is_admin, is_editor = authenticate_ldap_user("evil*)(uid=*", "password")
+
+    assert (is_authenticated, is_admin, is_editor) == (True, False, False)
+    mock_ldap_connection.search.assert_called_once_with(
+        "cn=admins,dc=example,dc=com",
+        "(member=uid=evil\\2a\\29\\28uid=\\2a,ou=users,dc=example,dc=com)",
+        attributes=["cn"],
+    )
+
+
+def test_read_connection_pool_reuses_released_connection(app, mock_ldap_connection):
+    """
+    GIVEN a successful LDAP search
+    WHEN a second search runs
+    THEN check that the pooled connection is reused instead of binding a new one
+    """
+    mock_ldap_connection.entries = []
+    with patch("app.ldap_utils.get_ldap_connection", return_value=mock_ldap_connection) as mock_connect:
+        assert not search_ldap("(objectClass=*)", ["cn"])
+        assert not search_ldap("(objectClass=*)", ["cn"])
+
+    mock_connect.assert_called_once()
+    assert mock_ldap_connection.search.call_count == 2
+    mock_ldap_connection.unbind.assert_not_called()
+
+
+def test_read_connection_pool_discards_failed_connection(app):
+    """
+    GIVEN an LDAP search that raises an LDAPException
+    WHEN the next search runs
+    THEN check that the failed connection was unbound and a fresh one is bound
+    """
+    broken_conn, fresh_conn = MagicMock(), MagicMock()
+    broken_conn.search.side_effect = LDAPException("connection lost")
+    fresh_conn.entries = []
+    with patch("app.ldap_utils.get_ldap_connection", side_effect=[broken_conn, fresh_conn]) as mock_connect:
+        assert get_entry_by_dn("cn=Test User,dc=example,dc=com", ["cn"]) is None
+        assert get_entry_by_dn("cn=Test User,dc=example,dc=com", ["cn"]) is None
+
+    assert mock_connect.call_count == 2
+    broken_conn.unbind.assert_called_once()
+    fresh_conn.unbind.assert_not_called()
+
+
+def test_read_connection_pool_retries_stale_connection(app):
+    """
+    GIVEN a pooled connection that the server has dropped while it sat idle
+    WHEN the next search borrows it and fails
+    THEN check that the search is retried on a fresh connection and its results returned
+    """
+    stale_conn, fresh_conn = MagicMock(), MagicMock()
+    stale_conn.entries = []
+    entry = MagicMock(entry_dn="cn=Test User,dc=example,dc=com")
+    entry.__getitem__.return_value.values = ["Test User"]
+    fresh_conn.entries = [entry]
+    with patch("app.ldap_utils.get_ldap_connection", side_effect=[stale_conn, fresh_conn]) as mock_connect:
+        search_ldap("(objectClass=*)", ["cn"])
+        stale_conn.search.side_effect = LDAPException("connection lost")
+        results = search_ldap("(objectClass=*)", ["cn"])
+
+    assert results == [{"dn": "cn=Test User,dc=example,dc=com", "cn": ["Test User"]}]
+    assert mock_connect.call_count == 2
+    stale_conn.unbind.assert_called_once()
+    fresh_conn.unbind.assert_not_called()
+
+
+def test_read_connection_pool_drops_idle_connection(app, mock_ldap_connection):
+    """
+    GIVEN a pooled connection that has been idle for longer than LDAP_POOL_IDLE_TIMEOUT
+    WHEN the next search runs
+    THEN check that the idle connection is unbound and a fresh one is bound
+    """
+    app.config["LDAP_POOL_IDLE_TIMEOUT"] = 60
+    mock_ldap_connection.entries = []
+    with patch("app.ldap_utils.get_ldap_connection", return_value=mock_ldap_connection) as mock_connect, patch(
+        "app.ldap_utils.time.monotonic", side_effect=[0, 61, 61]
+    ):
+        search_ldap("(objectClass=*)", ["cn"])
+        search_ldap("(objectClass=*)", ["cn"])
+
+    assert mock_connect.call_count == 2
+    mock_ldap_connection.unbind.assert_called_once()
@@ -19,14 +19,40 @@
 
 import base64
 
+import pytest
+
+from app.jobs import prepare_contact, store_contacts
+
+TEST_DN = "cn=Test User,dc=example,dc=com"
+TEST_B64_DN = base64.urlsafe_b64encode(TEST_DN.encode("utf-8")).decode("utf-8")
+COMPANY_A_B64 = base64.urlsafe_b64encode(b"Company A").decode("utf-8")
+
+
+@pytest.fixture
+def company_people():
+    """Contacts spread over two companies. Fresh per test, since prepare_contact mutates them."""
+    return [
+        {"dn": "cn=User One,dc=example,dc=com", "cn": ["User One"], "o": ["Company A"], "sn": ["One"]},
+        {"dn": "cn=User Two,dc=example,dc=com", "cn": ["User Two"], "o": ["Company B"], "sn": ["Two"]},
+        {"dn": "cn=User Three,dc=example,dc=com", "cn": ["User Three"], "o": ["Company A"], "sn": ["Three"]},
+    ]
 
-def login(client, username, password):
-    """Helper function to log in a user."""
-    return client.post(
-        "/login",
-        data={"username": username, "password": password, "auth_type": "local"},
-        follow_redirects=True,
-    )
+
+def login(client, user):
+    """
+    Helper function to log in a user by writing the Flask-Login session directly.
+    The login route itself is covered in test_auth_routes.
+    """
+    with client.session_transaction() as session:
+        session["_user_id"] = str(user.id)
+        session["_fresh"] = True
+
+
+def seed_contacts(people):
+    """Helper to prepare contacts and store them in the cache, as the refresh job does."""
+    prepared = [prepare_contact(p) for p in people]
+    store_contacts(prepared)
+    return prepared
 
 
 def test_index_page(client, mocker, test_user):
@@ -35,7 +61,7 @@ def test_index_page(client, mocker, test_user):
     WHEN the '/' page is requested (GET) by a logged in user
     THEN check that the response is valid
     """
-    login(client, test_user.username, "password")
+    login(client, test_user)
     mocker.patch("app.cache.get", return_value=[])
 
     response = client.get("/")
@@ -44,19 +70,66 @@ def test_index_page(client, mocker, test_user):
     assert b"Contacts" in response.data
 
 
+def test_index_page_filters(client, mocker, test_user):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN the '/' page is requested with a search query or a letter
+    THEN check that only the matching people are listed
+    """
+    login(client, test_user)
+    sample_people = [
+        {"dn": "cn=Alice Smith,dc=example,dc=com", "cn": ["Alice Smith"], "sn": ["Smith"]},
+        {"dn": "cn=Bob Jones,dc=example,dc=com", "cn": ["Bob Jones"], "sn": ["Jones"]},
+    ]
+    seed_contacts(sample_people)
+    mocker.patch("app.main.helpers.search_ldap", return_value=[])
+
+    response = client.get("/?q=alice")
+    assert b"Alice Smith" in response.data
+    assert base64.urlsafe_b64encode(b"cn=Alice Smith,dc=example,dc=com") in response.data
+    assert b"Bob Jones" not in response.data
+
+    response = client.get("/?letter=J")
+    assert b"Bob Jones" in response.data
+    assert b"Alice Smith" not in response.data
+
+    response = client.get("/?q=o&letter=S")
+    assert b"Alice Smith" not in response.data
+    assert b"Bob Jones" not in response.data
+
+    response = client.get("/?sort_by=cn&sort_order=desc")
+    assert response.data.index(b"Bob Jones") < response.data.index(b"Alice Smith")
+
+
+def test_index_page_clamps_page_number(client, mocker, test_user):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN the '/' page is requested with a page number below 1
+    THEN check that the first page is shown
+    """
+    login(client, test_user)
+    seed_contacts([{"dn": "cn=Alice Smith,dc=example,dc=com", "cn": ["Alice Smith"], "sn": ["Smith"]}])
+    mocker.patch("app.main.helpers.search_ldap", return_value=[])
+
+    for page in ("0", "-3"):
+        response = client.get(f"/?page={page}")
+        assert response.status_code == 200
+        assert b"Alice Smith" in response.data
+
+
 def test_companies_page(client, mocker, test_user):
     """
     GIVEN a Flask application configured for testing
     WHEN the '/companies' page is requested (GET) by a logged in user
     THEN check that the response is valid and displays companies
     """
-    login(client, test_user.username, "password")
+    login(client, test_user)
     sample_people = [
         {"dn": "cn=User 1,dc=example,dc=com", "cn": ["Test User 1"], "o": ["Company A"]},
         {"dn": "cn=User 2,dc=example,dc=com", "cn": ["Test User 2"], "o": ["Company B"]},
         {"dn": "cn=User 3,dc=example,dc=com", "cn": ["Test User 3"], "o": ["Company A"]},
     ]
-    mocker.patch("app.cache.get", return_value=sample_people)
+    seed_contacts(sample_people)
     mocker.patch("app.main.helpers.search_ldap", return_value=[])
 
     response = client.get("/companies")
@@ -66,77 +139,53 @@ def test_companies_page(client, mocker, test_user):
     assert b"Company B" in response.data
 
 
-def test_company_detail_page(client, mocker, test_user):
+def test_company_detail_page(client, mocker, test_user, company_people):
     """
     GIVEN a Flask application configured for testing
     WHEN the '/company/<b64_company_name>' page is requested (GET) by a logged in user
     THEN check that the response is valid and displays the correct employees
     """
-    login(client, test_user.username, "password")
-    sample_people = [
-        {"dn": "cn=User One,dc=example,dc=com", "cn": ["User One"], "o": ["Company A"], "sn": ["One"]},
-        {"dn": "cn=User Two,dc=example,dc=com", "cn": ["User Two"], "o": ["Company B"], "sn": ["Two"]},
-        {"dn": "cn=User Three,dc=example,dc=com", "cn": ["User Three"], "o": ["Company A"], "sn": ["Three"]},
-    ]
-    mocker.patch("app.cache.get", return_value=sample_people)
-
-    company_name = "Company A"
-    b64_company_name = base64.urlsafe_b64encode(company_name.encode("utf-8")).decode("utf-8")
+    login(client, test_user)
+    seed_contacts(company_people)
 
-    response = client.get(f"/company/{b64_company_name}")
+    response = client.get(f"/company/{COMPANY_A_B64}")
     assert response.status_code == 200
-    assert company_name.encode("utf-8") in response.data
+    assert b"Company A" in response.data
     assert b"User One" in response.data
     assert b"User Three" in response.data
     assert b"User Two" not in response.data
 
 
-def test_company_orgchart_page(client, mocker, test_user):
+def test_company_orgchart_page(client, mocker, test_user, company_people):
     """
     GIVEN a Flask application configured for testing
     WHEN the '/company/orgchart/<b64_company_name>' page is requested (GET) by a logged in user
     THEN check that the response is valid and displays the org chart
     """
-    login(client, test_user.username, "password")
-    sample_people = [
-        {"dn": "cn=User One,dc=example,dc=com", "cn": ["User One"], "o": ["Company A"], "sn": ["One"]},
-        {"dn": "cn=User Two,dc=example,dc=com", "cn": ["User Two"], "o": ["Company B"], "sn": ["Two"]},
-        {"dn": "cn=User Three,dc=example,dc=com", "cn": ["User Three"], "o": ["Company A"], "sn": ["Three"]},
-    ]
-    mocker.patch("app.cache.get", return_value=sample_people)
+    login(client, test_user)
+    seed_contacts(company_people)
 
-    company_name = "Company A"
-    b64_company_name = base64.urlsafe_b64encode(company_name.encode("utf-8")).decode("utf-8")
-
-    response = client.get(f"/company/orgchart/{b64_company_name}")
+    response = client.get(f"/company/orgchart/{COMPANY_A_B64}")
     assert response.status_code == 200
-    assert company_name.encode("utf-8") in response.data
+    assert b"Company A" in response.data
     assert b"Organization Chart" in response.data
     assert b"User One" in response.data
     assert b"User Three" in response.data
     assert b"User Two" not in response.data
 
 
-def test_company_cards_page(client, mocker, test_user):
+def test_company_cards_page(client, mocker, test_user, company_people):
     """
     GIVEN a Flask application configured for testing
     WHEN the '/company/cards/<b64_company_name>' page is requested (GET) by a logged in user
     THEN check that the response is valid and displays the correct employees
     """
-    login(client, test_user.username, "password")
-    sample_people = [
-        {"dn": "cn=User One,dc=example,dc=com", "cn": ["User One"], "o": ["Company A"], "sn": ["One"]},
-        {"dn": "cn=User Two,dc=example,dc=com", "cn": ["User Two"], "o": ["Company B"], "sn": ["Two"]},
-        {"dn": "cn=User Three,dc=example,dc=com", "cn": ["User Three"], "o": ["Company A"], "sn": ["Three"]},
-    ]
-    mocker.patch("app.cache.get", return_value=sample_people)
-
-    company_name = "Company A"
-    b64_company_name = base64.urlsafe_b64encode(company_name.encode("utf-8")).decode("utf-8")
+    login(client, test_user)
+    seed_contacts(company_people)
 
-    response = client.get(f"/company/cards/{b64_company_name}")
+    response = client.get(f"/company/cards/{COMPANY_A_B64}")
     assert response.status_code == 200
-    assert company_name.encode("utf-8") in response.data
+    assert b"Company A" in response.data
     assert b"User One" in response.data
     assert b"User Three" in response.data
     assert b"User Two" not in response.data
@@ -148,7 +197,7 @@ def test_person_detail_page(client, mocker, test_user):
     WHEN the '/person/<b64_dn>' page is requested (GET) by a logged in user
     THEN check that the response is valid and displays the correct person's details
     """
-    login(client, test_user.username, "password")
+    login(client, test_user)
     sample_person = {
         "dn": "cn=Test User,dc=example,dc=com",
         "cn": ["Test User"],
@@ -157,8 +206,7 @@ def test_person_detail_page(client, mocker, test_user):
     }
     mocker.patch("app.main.routes.get_entry_by_dn", return_value=sample_person)
 
-    dn = "cn=Test User,dc=example,dc=com"
-    b64_dn = base64.urlsafe_b64encode(dn.encode("utf-8")).decode("utf-8")
+    b64_dn = TEST_B64_DN
 
     response = client.get(f"/person/{b64_dn}")
     assert response.status_code == 200
@@ -167,13 +215,34 @@ def test_person_detail_page(client, mocker, test_user):
     assert b"123-456-7890" in response.data
 
 
+def test_person_detail_manager_from_cache(client, mocker, test_user):
+    """
+    GIVEN a person whose manager is in the contact cache
+    WHEN the '/person/<b64_dn>' page is requested (GET) by a logged in user
+    THEN check that the manager's name is shown without an extra LDAP lookup
+    """
+    login(client, test_user)
+    manager_dn = "cn=The Boss,dc=example,dc=com"
+    seed_contacts([{"dn": manager_dn, "cn": ["The Boss"]}])
+    sample_person = {"dn": "cn=Test User,dc=example,dc=com", "cn": ["Test User"], "manager": [manager_dn]}
+    mock_get_entry = mocker.patch("app.main.routes.get_entry_by_dn", return_value=sample_person)
+    mock_helper_get_entry = mocker.patch("app.main.helpers.get_entry_by_dn")
+
+    b64_dn = TEST_B64_DN
+    response = client.get(f"/person/{b64_dn}")
+    assert response.status_code == 200
+    assert b"The Boss" in response.data
+    mock_get_entry.assert_called_once()
+    mock_helper_get_entry.assert_not_called()
+
+
 def test_person_vcard_generation(client, mocker, test_user):
     """
     GIVEN a Flask application configured for testing
     WHEN the '/person/vcard/<b64_dn>' page is requested (GET) by a logged in user
     THEN check that a valid vCard is generated and returned
     """
-    login(client, test_user.username, "password")
+    login(client, test_user)
     sample_person = {
         "dn": "cn=Test User,dc=example,dc=com",
         "cn": ["Test User"],
@@ -188,8 +257,7 @@ def test_person_vcard_generation(client, mocker, test_user):
     }
     mocker.patch("app.main.routes.get_entry_by_dn", return_value=sample_person)
 
-    dn = "cn=Test User,dc=example,dc=com"
-    b64_dn = base64.urlsafe_b64encode(dn.encode("utf-8")).decode("utf-8")
+    b64_dn = TEST_B64_DN
 
     response = client.get(f"/person/vcard/{b64_dn}")
     assert response.status_code == 200
@@ -201,6 +269,9 @@ def test_person_vcard_generation(client, mocker, test_user):
     assert "FN:Test User" in vcard_data
     assert "EMAIL;TYPE=WORK,INTERNET:test@example.com" in vcard_data
     assert "END:VCARD" in vcard_data
+    assert vcard_data.startswith("BEGIN:VCARD\r\nVERSION:3.0\r\n")
+    assert vcard_data.endswith("END:VCARD\r\n")
+    assert int(response.headers["Content-Length"]) == len(response.data)
 
 
 def test_add_person_page_get(client, mocker, editor_user):
@@ -209,7 +280,7 @@ def test_add_person_page_get(client, mocker, editor_user):
     WHEN the '/person/add' page is requested (GET) by an editor
     THEN check that the response is valid
     """
-    login(client, editor_user.username, "password")
+    login(client, editor_user)
     mocker.patch("app.cache.get", return_value=[])
     response = client.get("/person/add")
     assert response.status_code == 200
@@ -222,7 +293,7 @@ def test_add_person_page_post(client, mocker, editor_user):
     WHEN the '/person/add' page is submitted (POST) by an editor
     THEN check that the new contact is added and the cache is refreshed
     """
-    login(client, editor_user.username, "password")
+    login(client, editor_user)
     mock_add_ldap_entry = mocker.patch("app.main.routes.add_ldap_entry", return_value=True)
     mock_scheduler_add_job = mocker.patch("app.scheduler.add_job")
 
@@ -255,13 +326,12 @@ def test_edit_person_page_get(client, mocker, editor_user):
     WHEN the '/person/edit/<b64_dn>' page is requested (GET) by an editor
     THEN check that the response is valid
     """
-    login(client, editor_user.username, "password")
+    login(client, editor_user)
     sample_person = {"dn": "cn=Test User,dc=example,dc=com", "cn": ["Test User"], "jpegPhoto": None}
     mocker.patch("app.main.routes.get_entry_by_dn", return_value=sample_person)
     mocker.patch("app.cache.get", return_value=[])
 
-    dn = "cn=Test User,dc=example,dc=com"
-    b64_dn = base64.urlsafe_b64encode(dn.encode("utf-8")).decode("utf-8")
+    b64_dn = TEST_B64_DN
 
     response = client.get(f"/person/edit/{b64_dn}")
     assert response.status_code == 200
@@ -274,7 +344,7 @@ def test_edit_person_page_post(client, mocker, editor_user):
     WHEN the '/person/edit/<b64_dn>' page is submitted (POST) by an editor
     THEN check that the contact is updated and the cache is refreshed
     """
-    login(client, editor_user.username, "password")
+    login(client, editor_user)
     sample_person = {
         "dn": "cn=Test User,dc=example,dc=com",
         "cn": ["Test User"],
@@ -284,12 +354,15 @@ def test_edit_person_page_post(client, mocker, editor_user):
     mock_scheduler_add_job = mocker.patch("app.scheduler.add_job")
 
     form_data = {"cn": "Updated Name"}
-    dn = "cn=Test User,dc=example,dc=com"
-    b64_dn = base64.urlsafe_b64encode(dn.encode("utf-8")).decode("utf-8")
+    b64_dn = TEST_B64_DN
 
-    response = client.post(f"/person/edit/{b64_dn}", data=form_data, follow_redirects=True)
-    assert response.status_code == 200
-    assert b"Person details updated successfully!" in response.data
+    response = client.post(f"/person/edit/{b64_dn}", data=form_data)
+    assert response.status_code == 302
+
+    with client.session_transaction() as session:
+        category, message = session["_flashes"][0]
+        assert category == "success"
+        assert "Person details updated successfully!" in message
     mock_modify_ldap_entry.assert_called_once()
     mock_scheduler_add_job.assert_called_once()
 
@@ -300,15 +373,165 @@ def test_delete_person_post(client, mocker, editor_user):
     WHEN the '/person/delete/<b64_dn>' page is submitted (POST) by an editor
     THEN check that the contact is deleted and the cache is refreshed
     """
-    login(client, editor_user.username, "password")
+    login(client, editor_user)
     mock_delete_ldap_contact = mocker.patch("app.main.routes.delete_ldap_contact", return_value=True)
     mock_scheduler_add_job = mocker.patch("app.scheduler.add_job")
 
-    dn = "cn=Test User,dc=example,dc=com"
-    b64_dn = base64.urlsafe_b64encode(dn.encode("utf-8")).decode("utf-8")
+    b64_dn = TEST_B64_DN
+
+    response = client.post(f"/person/delete/{b64_dn}")
+    assert response.status_code == 302
+
+    with client.session_transaction() as session:
+        category, message = session["_flashes"][0]
+        assert category == "success"
+        assert "Contact deleted successfully!" in message
+    mock_delete_ldap_contact.assert_called_once_with(TEST_DN)
+    mock_scheduler_add_job.assert_called_once()
 
-    response = client.post(f"/person/delete/{b64_dn}", follow_redirects=True)
+
+def test_avatar_caching_headers(client):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN an avatar is requested twice, the second time with its ETag
+    THEN check that it is cacheable and the repeat request returns 304
+    """
+    response = client.get("/avatar/test-seed.svg")
     assert response.status_code == 200
-    assert b"Contact deleted successfully!" in response.data
-    mock_delete_ldap_contact.assert_called_once_with(dn)
+    assert response.mimetype == "image/svg+xml"
+    assert response.cache_control.public
+    assert response.cache_control.max_age == 86400
+    etag = response.get_etag()[0]
+    assert etag
+
+    response = client.get("/avatar/test-seed.svg", headers={"If-None-Match": f'"{etag}"'})
+    assert response.status_code == 304
+
+
+def test_company_detail_unknown_company(client, test_user):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN the '/company/<b64_company_name>' page is requested for a company nobody works at
+    THEN check that a 404 is returned
+    """
+    login(client, test_user)
+    seed_contacts([{"dn": "cn=User One,dc=example,dc=com", "cn": ["User One"], "o": ["Company A"]}])
+
+    b64_company_name = base64.urlsafe_b64encode(b"Company Z").decode("utf-8")
+    response = client.get(f"/company/{b64_company_name}")
+    assert response.status_code == 404
+
+
+def test_cached_photo_rendered_as_data_url(client, mocker, test_user):
+    """
+    GIVEN a cached contact with a JPEG photo
+    WHEN the '/' page is requested (GET) by a logged in user
+    THEN check that the photo is rendered from the precomputed data URL and the raw bytes aren't cached
+    """
+    login(client, test_user)
+    photo = b"\xff\xd8\xff\xe0fake-jpeg"
+    [person] = seed_contacts(
+        [{"dn": "cn=Photo User,dc=example,dc=com", "cn": ["Photo User"], "sn": ["User"], "jpegPhoto": [photo]}]
+    )
+    mocker.patch("app.main.helpers.search_ldap", return_value=[])
+
+    assert "jpegPhoto" not in person
+    expected_src = "data:image/jpeg;base64," + base64.b64encode(photo).decode("ascii")
+    assert person["_avatar_data_url"] == expected_src
+
+    response = client.get("/")
+    assert response.status_code == 200
+    assert f'<img src="{expected_src}"'.encode("ascii") in response.data
+
+
+def test_writes_share_one_cache_refresh_job(client, mocker, editor_user):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN two contacts are deleted in a row
+    THEN check that both writes schedule the same replaceable cache refresh job
+    """
+    login(client, editor_user)
+    mocker.patch("app.main.routes.delete_ldap_contact", return_value=True)
+    mock_scheduler_add_job = mocker.patch("app.scheduler.add_job")
+
+    for dn in ("cn=User One,dc=example,dc=com", "cn=User Two,dc=example,dc=com"):
+        b64_dn = base64.urlsafe_b64encode(dn.encode("utf-8")).decode("utf-8")
+        client.post(f"/person/delete/{b64_dn}")
+
+    assert mock_scheduler_add_job.call_count == 2
+    for call in mock_scheduler_add_job.call_args_list:
+        assert call.kwargs["id"] == "ldap_cache_refresh"
+        assert call.kwargs["replace_existing"] is True
+        assert call.kwargs["max_instances"] > 1
+
+
+def test_toggle_privacy_schedules_refresh_without_sleeping(client, mocker, editor_user):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN a contact is moved into the user's private OU
+    THEN check that the shared cache refresh job is scheduled and the request doesn't sleep
+    """
+    login(client, editor_user)
+    mocker.patch("app.main.routes.ensure_ou_exists", return_value=True)
+    mock_move = mocker.patch("app.main.routes.move_ldap_entry", return_value=True)
+    mock_scheduler_add_job = mocker.patch("app.scheduler.add_job")
+    mock_sleep = mocker.patch("time.sleep")
+
+    dn = "cn=Test User,ou=contacts,dc=example,dc=com"
+    b64_dn = base64.urlsafe_b64encode(dn.encode("utf-8")).decode("utf-8")
+    response = client.post(f"/person/toggle_privacy/{b64_dn}")
+    assert response.status_code == 302
+
+    mock_move.assert_called_once_with(dn, f"ou=user_{editor_user.id},dc=example,dc=com")
     mock_scheduler_add_job.assert_called_once()
+    assert mock_scheduler_add_job.call_args.kwargs["id"] == "ldap_cache_refresh"
+    mock_sleep.assert_not_called()
+
+
+def test_missing_person_is_negative_cached(client, mocker, test_user):
+    """
+    GIVEN a DN that doesn't exist in LDAP
+    WHEN the '/person/<b64_dn>' page is requested twice
+    THEN check that both requests return 404 but LDAP is only searched once
+    """
+    login(client, test_user)
+    mock_get_entry = mocker.patch(
+        "app.main.routes.get_entry_by_dn", side_effect=lambda dn, attrs, not_found=None: not_found
+    )
+
+    b64_dn = base64.urlsafe_b64encode(b"cn=Nobody,dc=example,dc=com").decode("utf-8")
+    assert client.get(f"/person/{b64_dn}").status_code == 404
+    assert client.get(f"/person/{b64_dn}").status_code == 404
+    mock_get_entry.assert_called_once()
+
+
+def test_malformed_b64_dn_returns_404(client, test_user):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN a detail page is requested with a path segment that isn't valid base64
+    THEN check that a 404 is returned instead of a server error
+    """
+    login(client, test_user)
+    response = client.get("/person/not-valid-base64!")
+    assert response.status_code == 404
+
+
+def test_person_detail_revalidates_with_etag(client, mocker, test_user):
+    """
+    GIVEN a person detail page that was already fetched
+    WHEN it is requested again with the ETag from the first response
+    THEN check that a 304 without a body is returned
+    """
+    login(client, test_user)
+    sample_person = {"dn": "cn=Test User,dc=example,dc=com", "cn": ["Test User"]}
+    mocker.patch("app.main.routes.get_entry_by_dn", return_value=sample_person)
+
+    b64_dn = TEST_B64_DN
+    response = client.get(f"/person/{b64_dn}")
+    assert response.status_code == 200
+    assert response.cache_control.private
+    etag = response.get_etag()[0]
+
+    response = client.get(f"/person/{b64_dn}", headers={"If-None-Match": f'"{etag}"'})
+    assert response.status_code == 304
+    assert response.data == b""
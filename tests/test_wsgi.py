@@ -0,0 +1,67 @@
+# This file is part of Blackbook.
+#
+# Blackbook is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Blackbook is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Blackbook.  If not, see <https://www.gnu.org/licenses/>.
+
+#
+# Author: Taco Scheltema https://github.com/TacoScheltema/blackbook
+#
+
+import importlib
+import sys
+
+import pytest
+
+from app.models import User
+
+
+@pytest.fixture
+def import_wsgi(app, mocker, monkeypatch):
+    """Imports a fresh copy of wsgi.py that wraps the test app, with migrations mocked out."""
+    mocker.patch("app.create_app", return_value=app)
+    mock_upgrade = mocker.patch("flask_migrate.upgrade")
+    monkeypatch.delitem(sys.modules, "wsgi", raising=False)
+
+    def _import():
+        importlib.import_module("wsgi")
+        return mock_upgrade
+
+    return _import
+
+
+def test_startup_runs_migrations_and_creates_admin(import_wsgi, monkeypatch):
+    """
+    GIVEN BLACKBOOK_SKIP_STARTUP is not set
+    WHEN wsgi.py is imported
+    THEN check that migrations are applied and the default admin is created
+    """
+    monkeypatch.delenv("BLACKBOOK_SKIP_STARTUP", raising=False)
+
+    mock_upgrade = import_wsgi()
+
+    mock_upgrade.assert_called_once()
+    assert User.query.filter_by(username="admin").first() is not None
+
+
+def test_skip_startup(import_wsgi, monkeypatch):
+    """
+    GIVEN BLACKBOOK_SKIP_STARTUP=1
+    WHEN wsgi.py is imported
+    THEN check that the database is left untouched
+    """
+    monkeypatch.setenv("BLACKBOOK_SKIP_STARTUP", "1")
+
+    mock_upgrade = import_wsgi()
+
+    mock_upgrade.assert_not_called()
+    assert User.query.filter_by(username="admin").first() is None
@@ -18,7 +18,6 @@
 import os
 
 import click
-from flask_migrate import upgrade
 
 from app import create_app, db
 from app.models import User
@@ -31,6 +30,9 @@ def run_migrations():
     """
     Automatically applies database migrations on startup.
     """
+    # Imported here so that importing this module doesn't load Alembic.
+    from flask_migrate import upgrade
+
     # Check if the migrations directory exists
     migrations_dir = os.path.join(os.path.dirname(__file__), "migrations")
 
@@ -91,10 +93,13 @@ def ensure_default_admin():
 
 
 # --- Startup Sequence ---
-# 1. Apply DB Migrations
-run_migrations()
-# 2. Ensure Admin User Exists
-ensure_default_admin()
+# Set BLACKBOOK_SKIP_STARTUP=1 to import this module (e.g. from tooling or tests)
+# without touching the database.
+if os.environ.get("BLACKBOOK_SKIP_STARTUP") != "1":
+    # 1. Apply DB Migrations
+    run_migrations()
+    # 2. Ensure Admin User Exists
+    ensure_default_admin()
 
 
 @application.cli.command("create-admin")